@@ -0,0 +1,464 @@
+from __future__ import annotations
+
+import os, re, mmap, queue, shutil, string, tempfile, threading, subprocess
+from http.cookiejar import DefaultCookiePolicy
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import islice
+from typing import IO
+from urllib.parse import urlparse, urljoin, unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import streamlit as st
+import imageio_ffmpeg
+
+# HTML 파서: selectolax(Lexbor) 우선, 없으면 lxml + 미리 컴파일한 XPath
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+    from lxml import etree, html as lh
+    _XP_DOVE = etree.XPath(
+        "//div[contains(concat(' ', normalize-space(@class), ' '), ' react-dove-video ')]//video",
+        smart_strings=False)
+    _XP_ANY_VIDEO = etree.XPath("//video", smart_strings=False)
+    _XP_SRC = etree.XPath("@src | .//source/@src", smart_strings=False)
+
+# Optional CV/OCR
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "threads;4")  # 디코더 멀티스레드
+CV_THREADS = max(2, (os.cpu_count() or 2) // 2)
+
+def _env_threads(name: str, default: int = 2) -> int:
+    # OMP_NUM_THREADS 는 "4,2" 같은 중첩 표기도 허용되므로 첫 값만 사용
+    try:
+        return max(1, int(os.environ.get(name, "").split(",")[0]))
+    except ValueError:
+        return default
+
+# OMP_NUM_THREADS 등의 기본값은 app.py 가 streamlit 을 불러오기 전에 설정함
+TORCH_THREADS = _env_threads("OMP_NUM_THREADS")
+try:
+    import cv2
+    import numpy as np
+    import easyocr
+    import torch
+    torch.set_num_threads(TORCH_THREADS)
+    cv2.setNumThreads(CV_THREADS)
+    OCR_OK, OCR_ERR = True, None
+except Exception as e:
+    OCR_OK, OCR_ERR = False, e
+
+# ---------- regex ----------
+# 일반 URL 과 JS 이스케이프(https:\/\/...) URL 을 한 번의 스캔으로 찾음
+_MP4_ANY_RE = re.compile(r'https?:\\?/\\?[^\s"\'<>]+?\.mp4[^\s"\'<>]*', re.I)
+_FNAME_SANITIZE_RE = re.compile(r"[^\w\-. ]+")
+_CDN_RE = re.compile(r"(?:alicdn|alibaba)\.com")
+# ASCII 파일명은 정규식 대신 str.translate 로 치환 (허용 외 문자 → NUL 후 연속 구간을 "_" 하나로)
+_FNAME_SAFE = frozenset(string.ascii_letters + string.digits + "_-. ")
+_FNAME_TRANS = {i: "\0" for i in range(128) if chr(i) not in _FNAME_SAFE}
+
+# ---------- HTTP ----------
+DEFAULT_UA = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/126.0 Safari/537.36"
+)
+
+def _new_session(retry: bool = True) -> requests.Session:
+    s = requests.Session()
+    s.headers.update({
+        "User-Agent": DEFAULT_UA,
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "ko-KR,ko;q=0.9,en-US;q=0.8",
+        "Connection": "keep-alive",
+        "Pragma": "no-cache",
+        "Cache-Control": "no-cache",
+    })
+    # 프로세스 전체(모든 사용자)가 세션을 공유하므로 Set-Cookie 를 저장하지 않음
+    s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    # 커넥션 풀 재사용: HTML/비디오 요청 간 TCP+TLS 핸드셰이크 생략
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                          max_retries=Retry(total=2, backoff_factor=0.3) if retry else 0)
+    s.mount("http://", adapter); s.mount("https://", adapter)
+    return s
+
+@st.cache_resource(show_spinner=False)
+def get_session() -> requests.Session:
+    # 스크립트 재실행(rerun) 간에도 커넥션 풀 유지
+    return _new_session()
+
+@st.cache_resource(show_spinner=False)
+def _get_probe_session() -> requests.Session:
+    # HEAD 프로브는 힌트일 뿐이므로 재시도 없이 빨리 실패 (연결은 캐시되어 재사용)
+    return _new_session(retry=False)
+
+def referer_headers(referer: str | None) -> dict | None:
+    # 세션 상태를 바꾸지 않고 요청별로 Referer 전달 (일부 CDN은 필수)
+    return {"Referer": referer} if referer else None
+
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+def fetch_html(page_url: str) -> str:
+    r = get_session().get(page_url, headers=referer_headers("https://www.alibaba.com/"),
+                          timeout=25, allow_redirects=True)
+    r.raise_for_status()
+    return r.text
+
+# ---------- extraction ----------
+def _unescape_js_url(u: str) -> str:
+    return u.replace("\\/", "/")
+
+def absolutize(u: str, base: str) -> str:
+    return u if urlparse(u).netloc else urljoin(base, u)
+
+def _dom_video_srcs(html: str) -> list[str]:
+    found: list[str] = []
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(html)
+        # 1) 스크린샷 구조 → 2) 전역 fallback
+        for sel in ("div.react-dove-video video", "video"):
+            for v in tree.css(sel):
+                if v.attributes.get("src"):
+                    found.append(v.attributes["src"])
+                for s in v.css("source[src]"):
+                    if s.attributes.get("src"):
+                        found.append(s.attributes["src"])
+            if found:
+                break
+        return found
+
+    if not html.strip():
+        return found
+    try:
+        try:
+            tree = lh.fromstring(html)
+        except ValueError:  # XML 인코딩 선언이 있는 str 은 bytes 로만 파싱 가능
+            tree = lh.fromstring(html.encode("utf-8"))
+    except etree.ParserError:  # 주석/doctype 뿐인 문서 등 요소가 없는 경우
+        return found
+    # 1) 스크린샷 구조 → 2) 전역 fallback
+    for xp in (_XP_DOVE, _XP_ANY_VIDEO):
+        for v in xp(tree):
+            found.extend(u for u in _XP_SRC(v) if u)
+        if found:
+            break
+    return found
+
+def _prioritize(found: list[str], page_url: str) -> list[str]:
+    # 절대화/중복 제거/우선순위 (한 번에)
+    pri, sec, seen = [], [], set()
+    for u in found:
+        uu = absolutize(u, page_url)
+        if uu in seen:
+            continue
+        seen.add(uu)
+        (pri if _CDN_RE.search(uu) else sec).append(uu)
+    return pri + sec
+
+@st.cache_data(ttl=600, max_entries=128, show_spinner=False)
+def extract_video_urls_from_html(html: str, page_url: str) -> list[str]:
+    # 0) 인라인 JSON 등 원시 HTML 에 alicdn/alibaba .mp4 가 있으면 DOM 파싱 생략
+    raw_mp4 = [_unescape_js_url(m) for m in _MP4_ANY_RE.findall(html)]
+    if any(_CDN_RE.search(u) for u in raw_mp4):
+        return _prioritize(raw_mp4, page_url)
+
+    # 1), 2) DOM → 3) 원시 HTML에서 .mp4
+    found = _dom_video_srcs(html) or raw_mp4
+
+    return _prioritize(found, page_url)
+
+# ---------- filename ----------
+def _sanitize_filename(name: str) -> str:
+    if name.isascii():
+        return "_".join(filter(None, name.translate(_FNAME_TRANS).split("\0")))
+    return _FNAME_SANITIZE_RE.sub("_", name)
+
+def guess_filename_from_url(video_url: str) -> str:
+    name = os.path.basename(urlparse(video_url).path) or "video"
+    name = unquote(_sanitize_filename(name)).strip("._ ") or "video"
+    if not name.lower().endswith((".mp4", ".mov", ".m4v", ".webm")):
+        name += ".mp4"
+    return name
+
+# ---------- spooled / ranged download ----------
+SPOOL_MAX = 16 * 1024 * 1024  # 이 크기를 넘으면 디스크 임시파일로 전환
+RANGE_PARTS = 8
+RANGE_MIN_SIZE = 4 * 1024 * 1024  # 이보다 작으면 분할 이득이 없음
+
+def _probe_range_size(video_url: str, headers: dict | None) -> int | None:
+    # HEAD 로 Range 지원 여부와 크기 확인. 지원하지 않으면 None
+    try:
+        r = _get_probe_session().head(video_url, headers=headers, timeout=(3.05, 5), allow_redirects=True)
+    except requests.RequestException:
+        return None
+    if not r.ok or r.headers.get("Accept-Ranges", "").lower() != "bytes":
+        return None
+    try:
+        return int(r.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+class _RangeUnsupported(RuntimeError):
+    """HEAD 는 Range 를 광고했지만 실제 GET 이 206 으로 응답하지 않은 경우."""
+
+def _fetch_range(s: requests.Session, video_url: str, headers: dict | None,
+                 mm: mmap.mmap, lo: int, hi: int, cancel: threading.Event) -> None:
+    # 실패하면 cancel 을 세워 다른 구간도 바로 중단시킴 (중단된 구간은 조용히 반환)
+    try:
+        h = dict(headers or {}); h["Range"] = f"bytes={lo}-{hi}"
+        with s.get(video_url, headers=h, stream=True, timeout=120) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise _RangeUnsupported("CDN이 Range 요청을 지원하지 않습니다.")
+            pos = lo
+            for chunk in r.iter_content(chunk_size=1 << 20):
+                if cancel.is_set():
+                    return
+                if not chunk:
+                    continue
+                end = pos + len(chunk)
+                if end > hi + 1:
+                    raise RuntimeError("분할 다운로드 응답 크기가 올바르지 않습니다.")
+                mm[pos:end] = chunk; pos = end
+        if pos != hi + 1:
+            raise RuntimeError("분할 다운로드가 완료되지 않았습니다.")
+    except BaseException:
+        cancel.set()
+        raise
+
+def _fetch_video_ranged(video_url: str, headers: dict | None, size: int) -> IO[bytes]:
+    # 미리 크기를 잡은 임시파일을 mmap 하고 각 구간을 자기 오프셋에 기록
+    f = tempfile.TemporaryFile(mode="w+b")
+    try:
+        f.truncate(size)
+        step = -(-size // RANGE_PARTS)
+        ranges = [(lo, min(lo + step, size) - 1) for lo in range(0, size, step)]
+        s = get_session()  # 워커 스레드에서는 Streamlit 캐시 대신 같은 세션을 전달
+        cancel = threading.Event()
+        with mmap.mmap(f.fileno(), size) as mm:
+            with ThreadPoolExecutor(max_workers=RANGE_PARTS) as ex:
+                futs = [ex.submit(_fetch_range, s, video_url, headers, mm, lo, hi, cancel) for lo, hi in ranges]
+            # 모든 워커가 끝난 뒤 실제 실패(중단된 구간 제외)를 전달
+            for fu in futs:
+                fu.result()
+            mm.flush()
+    except BaseException:
+        f.close()
+        raise
+    f.seek(0)
+    return f
+
+def fetch_video_bytes(video_url: str, page_url: str, max_bytes: int = 800 * 1024 * 1024) -> IO[bytes]:
+    headers = referer_headers(page_url)
+    size = _probe_range_size(video_url, headers)
+    if size is not None and size > max_bytes:
+        raise RuntimeError("파일이 너무 큽니다. 다운로드 한도를 초과했습니다.")
+    if size is not None and size >= RANGE_MIN_SIZE:
+        try:
+            return _fetch_video_ranged(video_url, headers, size)
+        except _RangeUnsupported:
+            pass  # HEAD 와 달리 GET 이 Range 를 무시 → 단일 스트림으로 재시도
+
+    # Range 미지원/소형 파일: 단일 스트림
+    buf = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX, mode="w+b")
+    with get_session().get(video_url, headers=headers, stream=True, timeout=120) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(chunk_size=1 << 20):
+            if not chunk:
+                continue
+            buf.write(chunk)
+            if buf.tell() > max_bytes:
+                buf.close()
+                raise RuntimeError("파일이 너무 큽니다. 다운로드 한도를 초과했습니다.")
+    buf.seek(0)
+    return buf
+
+# ---------- OCR blur ----------
+def blur_boxes_in_frame(frame, boxes, ksize=25, scratch=None, mask=None):
+    fh, fw = frame.shape[:2]
+    rects = []
+    for (x0, y0, x1, y1) in boxes:
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(fw, x1), min(fh, y1)
+        if x1 > x0 and y1 > y0:
+            rects.append((x0, y0, x1, y1))
+    if not rects:
+        return frame
+
+    # 박스들을 감싸는 밴드를 한 번만 블러하고 마스크 영역만 덮어씀
+    by0 = min(r[1] for r in rects); by1 = max(r[3] for r in rects)
+    band = frame[by0:by1]
+    k = max(3, ksize | 1)
+    # scratch/mask: 프레임과 같은 크기의 재사용 버퍼 (있으면 프레임마다 새로 할당하지 않음)
+    blurred = cv2.GaussianBlur(band, (k, k), 0, dst=None if scratch is None else scratch[by0:by1])
+    if mask is None:
+        m = np.zeros(band.shape[:2], bool)
+    else:
+        m = mask[by0:by1]; m.fill(False)
+    for (x0, y0, x1, y1) in rects:
+        m[y0 - by0:y1 - by0, x0:x1] = True
+    np.copyto(band, blurred, where=m[:, :, None])
+    return frame
+
+def iter_frames_threaded(cap, shape, hold, maxsize=8):
+    # 디코딩을 백그라운드 스레드로 분리해 OCR/블러/인코딩과 겹치게 함.
+    # 프레임은 미리 할당한 버퍼 링에 디코딩되므로 소비자는 최근 hold 개까지만 붙잡고 있어야 함
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    arena = [np.empty(shape, np.uint8) for _ in range(maxsize + hold + 1)]
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1); return
+            except queue.Full:
+                pass
+
+    def run():
+        try:
+            k = 0
+            while not stop.is_set():
+                ret, frame = cap.read(arena[k % len(arena)])
+                if not ret: break
+                put(frame); k += 1
+        finally:
+            put(None)
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    try:
+        while (frame := q.get()) is not None:
+            yield frame
+    finally:
+        stop.set(); t.join()
+
+OCR_BATCH = 16  # 한 번에 디코딩해 OCR 배치로 묶을 프레임 수
+OCR_DIFF_TH = 2.0  # 밴드 썸네일 평균 차이가 이보다 작으면 OCR 생략
+
+def _boxes_from_results(results, conf_th):
+    boxes = []
+    for poly, text, conf in results:
+        if conf is None or conf < conf_th:
+            continue
+        xs = [int(p[0]) for p in poly]
+        ys = [int(p[1]) for p in poly]
+        boxes.append((min(xs), min(ys), max(xs), max(ys)))
+    return boxes
+
+def ocr_detect_boxes_batched(bands, reader, conf_th=0.45, batch_size=OCR_BATCH):
+    # 같은 크기의 밴드들을 한 번의 readtext_batched 호출로 처리
+    bh, bw = bands[0].shape[:2]
+    cv2.setNumThreads(1)  # OCR 중에는 torch 에 코어를 양보
+    try:
+        results = reader.readtext_batched(bands, n_width=bw, n_height=bh,
+                                          batch_size=batch_size, detail=1)
+    finally:
+        cv2.setNumThreads(CV_THREADS)
+    return [_boxes_from_results(r, conf_th) for r in results]
+
+def open_ffmpeg_writer(dst: str, w: int, h: int, fps: float, audio_src: str | None = None) -> subprocess.Popen:
+    # BGR 원시 프레임을 stdin 으로 받아 libx264 로 한 번에 인코딩.
+    # 원본 오디오는 있으면 AAC 로 변환 (webm 의 Vorbis/Opus 등은 mp4 에 그대로 복사할 수 없음)
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+           "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{w}x{h}", "-r", f"{fps}", "-i", "-"]
+    if audio_src:
+        cmd += ["-i", audio_src, "-map", "0:v", "-map", "1:a?", "-c:a", "aac", "-b:a", "128k", "-shortest"]
+    cmd += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",  # yuv420p 는 짝수 해상도 필요
+            "-c:v", "libx264", "-preset", "ultrafast", "-threads", "0",
+            "-pix_fmt", "yuv420p", "-movflags", "+faststart", dst]
+    # stderr 를 PIPE 로 두면 오류 출력이 파이프 버퍼(~64KB)를 넘을 때 stdin 쓰기와 교착되므로 임시파일로 받음
+    err_log = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=err_log)
+    except BaseException:
+        err_log.close(); raise
+    proc.err_log = err_log
+    return proc
+
+def close_ffmpeg_writer(proc: subprocess.Popen) -> None:
+    try:
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass
+    rc = proc.wait()
+    with proc.err_log as f:
+        f.seek(0); err = f.read().decode(errors="replace").strip()
+    if rc != 0:
+        raise RuntimeError(f"출력 비디오를 생성할 수 없습니다: {err}")
+
+def kill_ffmpeg_writer(proc: subprocess.Popen) -> None:
+    proc.kill(); proc.wait(); proc.err_log.close()
+
+@st.cache_resource(show_spinner=False)
+def _get_easyocr_reader():
+    # 가중치 로딩(수 초)을 프로세스당 한 번만
+    import easyocr
+    return easyocr.Reader(['en','ko'], gpu=False)
+
+def auto_blur_bottom_text(input_bytes,
+                          bottom_ratio=0.20,
+                          sample_step=2,
+                          conf_th=0.45,
+                          blur_ksize=27,
+                          downscale=2) -> BytesIO:
+    if not OCR_OK:
+        raise RuntimeError(f"자동 감지 블러를 사용하려면 OpenCV/easyocr가 필요합니다: {OCR_ERR}")
+
+    with tempfile.TemporaryDirectory() as td:
+        src = os.path.join(td, "in.mp4"); dst = os.path.join(td, "out.mp4")
+        input_bytes.seek(0)
+        with open(src, "wb") as f: shutil.copyfileobj(input_bytes, f, length=1 << 20)
+
+        cap = cv2.VideoCapture(src, cv2.CAP_FFMPEG)
+        if not cap.isOpened(): raise RuntimeError("비디오를 열 수 없습니다.")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)); h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        reader = _get_easyocr_reader()
+        band_y0 = int(h * (1.0 - bottom_ratio)); band_y1 = h
+        # OCR 은 축소한 밴드로 수행하고 박스 좌표만 원본 크기로 되돌림
+        d = max(1, int(downscale))
+        sw, sh = max(1, w // d), max(1, (band_y1 - band_y0) // d)
+        sx, sy = w / sw, (band_y1 - band_y0) / sh
+        out = open_ffmpeg_writer(dst, w, h, fps, audio_src=src)
+        frames_it = iter_frames_threaded(cap, (h, w, 3), hold=OCR_BATCH)
+        blur_scratch = np.empty((h, w, 3), np.uint8)
+        blur_mask = np.zeros((h, w), bool)
+        try:
+            frame_idx, cached_boxes, prev_thumb = 0, [], None
+            while True:
+                frames = list(islice(frames_it, OCR_BATCH))
+                if not frames: break
+
+                # 1) 구간 내 샘플 프레임 중 하단 밴드가 바뀐 것만 배치 OCR
+                sampled = []
+                for i in range(len(frames)):
+                    if (frame_idx + i) % sample_step:
+                        continue
+                    thumb = cv2.resize(frames[i][band_y0:band_y1, 0:w], (64, 16), interpolation=cv2.INTER_AREA)
+                    if prev_thumb is not None and cv2.absdiff(prev_thumb, thumb).mean() < OCR_DIFF_TH:
+                        continue  # 자막 변화 없음 → 직전 박스 유지
+                    sampled.append(i); prev_thumb = thumb
+                boxes_at = {}
+                if sampled:
+                    bands = [frames[i][band_y0:band_y1, 0:w] for i in sampled]
+                    if d > 1:
+                        bands = [cv2.resize(b, (sw, sh), interpolation=cv2.INTER_AREA) for b in bands]
+                    for i, boxes_band in zip(sampled, ocr_detect_boxes_batched(bands, reader, conf_th=conf_th)):
+                        boxes_at[i] = [(int(x0 * sx), int(y0 * sy) + band_y0, int(x1 * sx + 0.5), int(y1 * sy + 0.5) + band_y0)
+                                       for (x0, y0, x1, y1) in boxes_band]
+
+                # 2) 샘플 사이 프레임은 직전 박스를 재사용해 블러 후 ffmpeg 로 전달
+                for i, frame in enumerate(frames):
+                    cached_boxes = boxes_at.get(i, cached_boxes)
+                    out.stdin.write(blur_boxes_in_frame(frame, cached_boxes, ksize=blur_ksize, scratch=blur_scratch, mask=blur_mask).data)
+                frame_idx += len(frames)
+                if len(frames) < OCR_BATCH: break
+        except BrokenPipeError:
+            frames_it.close(); cap.release(); close_ffmpeg_writer(out); raise  # ffmpeg 오류 메시지로 보고
+        except BaseException:
+            frames_it.close(); cap.release(); kill_ffmpeg_writer(out); raise
+        frames_it.close(); cap.release(); close_ffmpeg_writer(out)
+        with open(dst, "rb") as f:
+            out_bytes = BytesIO(f.read())
+        out_bytes.seek(0); return out_bytes